@@ -9,52 +9,103 @@ Default layout created by this script:
   web/
     index.html                (optional; use --write-index to generate)
     np_trailmaps.json         (data index consumed by index.html)
+    np_trailmaps.json.gz      (pre-compressed copy; index.html prefers it when it can inflate it)
+    np_trailmaps.json.br      (brotli copy for servers with brotli_static; written when brotli is installed)
+    .sha_cache.json           (size/mtime -> digest + ETag/Last-Modified cache for reruns)
     pdfs/                     (all PDFs stored here)
 
 Usage:
   python3 build_np_pdf_index.py --csv national_parks_trailmaps.csv --out web --write-index
   python3 build_np_pdf_index.py --csv national_parks_trailmaps.csv --out /var/www/np --workers 6
   python3 build_np_pdf_index.py --csv national_parks_trailmaps.csv --out web --force
+  python3 build_np_pdf_index.py --csv national_parks_trailmaps.csv --out web --refresh
 
 Dependencies:
   pip install requests
+  pip install orjson        (optional; faster JSON output)
+  pip install brotli        (optional; also writes a .br copy of the JSON)
+  pip install blake3        (optional; for --hash-algo blake3)
 """
 
 import argparse
 import csv
+import gzip
 import hashlib
+import io
 import json
 import os
+import queue
 import re
+import shutil
 import sys
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Any
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import requests
-
-LOCK = threading.Lock()
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # optional; falls back to the stdlib json module
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; only the .gz copy is written without it
+    brotli = None
+
+try:
+    import blake3
+except ImportError:  # optional; only needed for --hash-algo blake3
+    blake3 = None
+
+HASH_ALGOS = ("sha256", "blake3")
+
+# Downloads are copied in FLUSH_SIZE blocks so large PDFs cost a handful of
+# hashlib/write calls instead of one per network chunk.
+CHUNK_SIZE = 1024 * 1024
+FLUSH_SIZE = 4 * 1024 * 1024
+
+_STRIP_NONWORD = re.compile(r"[^\w\s\-]+")
+_WS = re.compile(r"\s+")
+_DASHES = re.compile(r"-{2,}")
+_PDF_EXT = re.compile(r"\.pdf($|\?.*)", re.I)
+_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+_TRAILING_VER = re.compile(r"[ _-]?(20\d{2}|19\d{2}|v\d+)$")
+_STATE_SEP = re.compile(r"[;,]")
 
 def slugify(value: str) -> str:
     value = value.strip().lower()
     value = value.replace("’", "'").replace("–", "-").replace("—", "-")
-    value = re.sub(r"[^\w\s\-]+", "", value)
-    value = re.sub(r"\s+", " ", value)
-    value = re.sub(r"\s+", "-", value.strip())
-    value = re.sub(r"-{2,}", "-", value)
+    value = _STRIP_NONWORD.sub("", value)
+    value = _WS.sub(" ", value)
+    value = _WS.sub("-", value.strip())
+    value = _DASHES.sub("-", value)
     return value.strip("-")[:80] or "file"
 
+@lru_cache(maxsize=1024)
+def url_stem(url: str) -> Optional[str]:
+    # Parsed once per URL and shared by title and filename derivation, which
+    # run close together for the same row; a small bounded cache covers that.
+    # None means the URL path has no basename at all.
+    base = os.path.basename(urlparse(url).path)
+    return _PDF_EXT.sub("", base) if base else None
+
 def derive_title_from_url(url: str) -> str:
-    name = os.path.basename(urlparse(url).path) or "Map"
-    name = re.sub(r"\.pdf($|\?.*)", "", name, flags=re.I)
+    stem = url_stem(url)
+    name = "Map" if stem is None else stem
     name = name.replace("_", " ").replace("-", " ")
-    name = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", name)
-    name = re.sub(r"\s+", " ", name).strip()
+    name = _CAMEL.sub(" ", name)
+    name = _WS.sub(" ", name).strip()
     if len(name) > 80:
-        name = re.sub(r"[ _-]?(20\d{2}|19\d{2}|v\d+)$", "", name).strip()
+        name = _TRAILING_VER.sub("", name).strip()
     def smart_title(s: str) -> str:
         words = s.split()
         out = []
@@ -66,131 +117,425 @@ def derive_title_from_url(url: str) -> str:
         return " ".join(out)
     return smart_title(name) or "Map"
 
-def secure_filename(park: str, url: str, existing: set) -> str:
-    park_slug = slugify(park)
-    base = os.path.basename(urlparse(url).path) or "map.pdf"
-    base_slug = slugify(re.sub(r"\.pdf($|\?.*)", "", base, flags=re.I)) or "map"
+# Park names repeat across many CSV rows, so the per-park slug is memoized.
+# The cache is bounded in case a catalog has very many distinct parks.
+@lru_cache(maxsize=1024)
+def park_slug(park: str) -> str:
+    return slugify(park)
+
+def base_slug(url: str) -> str:
+    stem = url_stem(url)
+    return slugify("map" if stem is None else stem) or "map"
+
+def secure_filename(park: str, url: str) -> str:
+    # Deterministic per (park, url): the 64-bit URL hash makes collisions
+    # negligible, so no directory scan or collision loop is needed.
+    h = hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{park_slug(park)}__{base_slug(url)}__{h}.pdf"
+
+def legacy_filename(park: str, url: str) -> str:
+    # Name used before secure_filename switched to blake2b; existing archives
+    # still hold PDFs under it.
     h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:8]
-    guess = f"{park_slug}__{base_slug}__{h}.pdf"
-    if guess in existing:
-        i = 1
-        while True:
-            alt = f"{park_slug}__{base_slug}__{h}-{i}.pdf"
-            if alt not in existing:
-                return alt
-            i += 1
-    return guess
-
-def read_csv_rows(csv_path: Path) -> List[Dict[str, str]]:
-    rows = []
-    with csv_path.open("r", newline="", encoding="utf-8") as f:
+    return f"{park_slug(park)}__{base_slug(url)}__{h}.pdf"
+
+def item_id(park: str, url: str) -> str:
+    return hashlib.blake2b(f"{park}|{url}".encode("utf-8"), digest_size=6).hexdigest()
+
+def read_csv_rows(csv_path: Path) -> Iterator[Dict[str, str]]:
+    # The header is checked here, before anything is returned, so a bad CSV
+    # fails before build_index touches the output directory. Rows are then
+    # yielded as they are parsed so downloads can start before the whole CSV
+    # has been read.
+    f = csv_path.open("r", newline="", encoding="utf-8")
+    try:
         reader = csv.DictReader(f)
         expected = {"park", "state", "pdf_url"}
         if not expected.issubset(set(reader.fieldnames or [])):
             raise ValueError(f"CSV must have columns: park,state,pdf_url (found {reader.fieldnames})")
+    except BaseException:
+        f.close()
+        raise
+    return _iter_csv_rows(f, reader)
+
+def _iter_csv_rows(f, reader: csv.DictReader) -> Iterator[Dict[str, str]]:
+    with f:
         for r in reader:
             url = (r.get("pdf_url") or "").strip()
             park = (r.get("park") or "").strip()
             state = (r.get("state") or "").strip()
             if not url or not park:
                 continue
-            rows.append({"park": park, "state": state, "pdf_url": url})
-    return rows
+            yield {"park": park, "state": state, "pdf_url": url}
 
-def split_states(state_field: str) -> List[str]:
+@lru_cache(maxsize=1024)
+def _split_states(state_field: str) -> Tuple[str, ...]:
     parts = []
-    for token in re.split(r"[;,]", state_field or ""):
+    for token in _STATE_SEP.split(state_field):
         token = token.strip()
         if token:
             parts.append(token)
-    return parts or []
+    return tuple(parts)
+
+def unique_rows(rows: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+    # Drop rows that map to an already-seen PDF filename before they reach a
+    # worker. Keying on the filename rather than (park, url) also catches park
+    # names that differ only in case or punctuation; otherwise two workers
+    # would write the same file at once.
+    seen = set()
+    for r in rows:
+        key = secure_filename(r["park"], r["pdf_url"])
+        if key in seen:
+            continue
+        seen.add(key)
+        yield r
 
-def download_one(session: requests.Session, url: str, dest: Path, timeout: int, verify_tls: bool=True) -> Tuple[bool, int, str]:
+def split_states(state_field: str) -> List[str]:
+    return list(_split_states(state_field or ""))
+
+def file_sha256(path: Path) -> str:
+    with path.open("rb", buffering=0) as fh:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(fh, "sha256").hexdigest()
+        hasher = hashlib.sha256()
+        for block in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            hasher.update(block)
+        return hasher.hexdigest()
+
+def new_hasher(algo: str="sha256"):
+    if algo == "blake3":
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return hashlib.new(algo)
+
+def file_hash(path: Path, algo: str="sha256") -> str:
+    if algo == "blake3":
+        # Memory-maps the file and hashes it with multi-threaded SIMD.
+        return new_hasher(algo).update_mmap(path).hexdigest()
+    return file_sha256(path)
+
+def load_sha_cache(path: Path) -> Dict[str, Dict[str, Any]]:
     try:
-        with session.get(url, stream=True, timeout=timeout, allow_redirects=True, verify=verify_tls) as r:
-            r.raise_for_status()
-            hasher = hashlib.sha256()
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def save_sha_cache(path: Path, cache: Dict[str, Dict[str, Any]]):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def remember_digest(cache: Dict[str, Dict[str, Any]], path: Path, digest_hex: str, validators: Optional[Dict[str, str]]=None, algo: str="sha256"):
+    # Digests are stored under their algorithm name; any other digests for the
+    # same unchanged file are kept.
+    entry = cache_entry(cache, path) if validators is None else None
+    if entry is None:
+        st = path.stat()
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    entry[algo] = digest_hex
+    entry.update(validators or {})
+    cache[path.name] = entry
+
+def remember_validators(cache: Dict[str, Dict[str, Any]], path: Path, validators: Dict[str, str]):
+    # Lets the next --refresh send a conditional HEAD for a file whose
+    # validators were never recorded.
+    entry = cache_entry(cache, path)
+    if entry is None:
+        st = path.stat()
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    entry.update(validators)
+    cache[path.name] = entry
+
+def cache_entry(cache: Dict[str, Dict[str, Any]], path: Path) -> Optional[Dict[str, Any]]:
+    # An entry is only trusted while the file's size and mtime are unchanged.
+    st = path.stat()
+    entry = cache.get(path.name)
+    if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return entry
+    return None
+
+def cached_digest(cache: Dict[str, Dict[str, Any]], path: Path, algo: str="sha256") -> str:
+    entry = cache_entry(cache, path)
+    if entry and entry.get(algo):
+        return entry[algo]
+    digest_hex = file_hash(path, algo)
+    remember_digest(cache, path, digest_hex, algo=algo)
+    return digest_hex
+
+def _open_tmpfile(directory: Path) -> int:
+    if not hasattr(os, "O_TMPFILE"):
+        return -1
+    try:
+        return os.open(str(directory), os.O_TMPFILE | os.O_WRONLY, 0o644)
+    except OSError:
+        # Filesystem doesn't support unnamed temp files (e.g. some network mounts).
+        return -1
+
+def _link_tmpfile(fd: int, dest: Path):
+    # Passing a dir fd makes CPython use linkat(AT_SYMLINK_FOLLOW), which is
+    # required to resolve the /proc/self/fd magic link to the unnamed file.
+    dir_fd = os.open(str(dest.parent), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.link(f"/proc/self/fd/{fd}", dest.name, dst_dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
+
+@contextmanager
+def staged_file(dest: Path, durable: bool=False) -> Iterator[BinaryIO]:
+    # On Linux the data goes to an unnamed O_TMPFILE that is linked into place
+    # only once fully written, so a crash leaves no .part residue behind.
+    # Elsewhere we fall back to writing a .part file and renaming it.
+    fd = _open_tmpfile(dest.parent)
+    if fd < 0:
+        tmp = dest.with_suffix(dest.suffix + ".part")
+        with tmp.open("wb") as f:
+            yield f
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        tmp.replace(dest)
+        return
+
+    with os.fdopen(fd, "wb") as f:
+        yield f
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+        try:
+            _link_tmpfile(f.fileno(), dest)
+        except FileExistsError:
+            # linkat can't replace an existing file; link beside it and rename over.
             tmp = dest.with_suffix(dest.suffix + ".part")
-            size = 0
-            with tmp.open("wb") as f:
-                for chunk in r.iter_content(chunk_size=64 * 1024):
-                    if not chunk:
-                        continue
-                    f.write(chunk)
-                    hasher.update(chunk)
-                    size += len(chunk)
+            tmp.unlink(missing_ok=True)
+            _link_tmpfile(f.fileno(), tmp)
             tmp.replace(dest)
-            return True, size, hasher.hexdigest()
+
+class DigestingReader(io.RawIOBase):
+    """Read-through wrapper that hashes and counts bytes as they are read."""
+
+    def __init__(self, raw, hasher):
+        self._raw = raw
+        self.hasher = hasher
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._raw.readinto(b) or 0
+        if n:
+            with memoryview(b) as view:
+                self.hasher.update(view[:n])
+            self.size += n
+        return n
+
+def response_validators(r: requests.Response) -> Dict[str, str]:
+    validators = {}
+    if r.headers.get("ETag"):
+        validators["etag"] = r.headers["ETag"]
+    if r.headers.get("Last-Modified"):
+        validators["last_modified"] = r.headers["Last-Modified"]
+    return validators
+
+def remote_unchanged(session: requests.Session, url: str, entry: Optional[Dict[str, Any]], size: int, timeout: int, verify_tls: bool=True) -> Tuple[bool, Dict[str, str]]:
+    # Conditional HEAD against the validators stored with the local copy; a 304
+    # (or a matching ETag/Last-Modified from servers that ignore the
+    # condition) means keep it. Without stored validators a plain HEAD is
+    # sent instead: the copy is kept unless Content-Length disagrees with its
+    # size, and the validators it returns are handed back for the cache.
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        r = session.head(url, headers=headers, timeout=timeout, allow_redirects=True, verify=verify_tls)
     except Exception:
-        return False, 0, ""
+        # Can't reach the server; keep the copy we already have.
+        return True, {}
+    if not headers:
+        if not r.ok:
+            return True, {}
+        length = r.headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) != size:
+            return False, {}
+        return True, response_validators(r)
+    if r.status_code == 304:
+        return True, {}
+    if r.ok and entry.get("etag") and r.headers.get("ETag") == entry["etag"]:
+        return True, {}
+    if r.ok and entry.get("last_modified") and r.headers.get("Last-Modified") == entry["last_modified"]:
+        return True, {}
+    return False, {}
+
+def download_one(session: requests.Session, url: str, dest: Path, timeout: int, verify_tls: bool=True, durable: bool=False, hash_algo: str="sha256") -> Tuple[bool, int, str, Dict[str, str]]:
+    try:
+        with session.get(url, stream=True, timeout=timeout, allow_redirects=True, verify=verify_tls) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            reader = DigestingReader(r.raw, new_hasher(hash_algo))
+            with staged_file(dest, durable=durable) as f:
+                shutil.copyfileobj(reader, f, length=FLUSH_SIZE)
+            return True, reader.size, reader.hasher.hexdigest(), response_validators(r)
+    except Exception:
+        return False, 0, "", {}
+
+def make_session(workers: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"User-Agent": "prepper-disk-fetch/1.0 (+offline archival)"})
+    # Size the keep-alive pool to the worker count so threads reuse connections
+    # instead of discarding them once the default pool of 10 is exhausted.
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=max(workers, 1), pool_maxsize=max(workers, 1) * 2, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 def ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
-def build_index(rows: List[Dict[str, str]], pdf_dir: Path, force: bool, workers: int, timeout: int, verify_tls: bool=True) -> Dict[str, Any]:
+def build_index(rows: Iterable[Dict[str, str]], pdf_dir: Path, force: bool, workers: int, timeout: int, verify_tls: bool=True, cache_path: Optional[Path]=None, durable: bool=False, refresh: bool=False, hash_algo: str="sha256") -> Dict[str, Any]:
     ensure_dir(pdf_dir)
-    session = requests.Session()
-    session.headers.update({"User-Agent": "prepper-disk-fetch/1.0 (+offline archival)"} )
+    sha_cache = load_sha_cache(cache_path) if cache_path else {}
+    session = make_session(workers)
 
-    existing_names = set(os.listdir(pdf_dir)) if pdf_dir.exists() else set()
-    items: List[Dict[str, Any]] = []
-    seen_keys = set()
+    # SimpleQueue.put is thread-safe without a lock, including on free-threaded builds.
+    results: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
 
-    def process_row(r: Dict[str, str]):
+    # Rehashing existing files is CPU-bound. hashlib releases the GIL while
+    # digesting, so a CPU-sized thread pool spreads it across cores without
+    # tying up the download workers.
+    hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="hash")
+
+    def report_failure(fut, url: str):
+        exc = fut.exception()
+        if exc is not None:
+            print(f"[WARN] Failed to process {url}: {exc}", file=sys.stderr)
+
+    def process_row(r: Dict[str, str]) -> Optional[Future]:
+        # Returns the pending rehash when the digest is computed on hash_pool.
         park = r["park"]
         states = split_states(r["state"])
         url = r["pdf_url"]
-        key = (park, url)
-        if key in seen_keys:
-            return
-        seen_keys.add(key)
-
         title = derive_title_from_url(url)
-        filename = secure_filename(park, url, existing_names)
+        filename = secure_filename(park, url)
         dest = pdf_dir / filename
 
-        if dest.exists() and not force:
-            size = dest.stat().st_size
-            sha256_hex = ""
-            item = {
-                "id": hashlib.sha1(f"{park}|{url}".encode("utf-8")).hexdigest()[:12],
-                "park": park,
-                "states": states,
-                "title": title,
-                "filename": filename,
-                "path": str(Path(pdf_dir.name) / filename),
-                "size_bytes": int(size),
-                "sha256": sha256_hex,
-                "source_url": url,
-                "download_ok": True
-            }
-            with LOCK:
-                items.append(item)
-            return
-
-        ok, size, sha256_hex = download_one(session, url, dest, timeout, verify_tls=verify_tls)
+        exists = dest.exists()
+        if not exists:
+            legacy = pdf_dir / legacy_filename(park, url)
+            if legacy.exists():
+                # Adopt the copy saved under the old name (and its cache
+                # entry; os.replace keeps size and mtime) instead of
+                # downloading it again.
+                os.replace(legacy, dest)
+                entry = sha_cache.pop(legacy.name, None)
+                if entry is not None:
+                    sha_cache[filename] = entry
+                exists = True
+        reuse = exists and not force
+        if reuse and refresh:
+            reuse, validators = remote_unchanged(session, url, cache_entry(sha_cache, dest), dest.stat().st_size, timeout, verify_tls=verify_tls)
+            if validators:
+                remember_validators(sha_cache, dest, validators)
+
+        def index_existing() -> Optional[Future]:
+            def emit_existing():
+                size = dest.stat().st_size
+                digest_hex = cached_digest(sha_cache, dest, hash_algo)
+                item = {
+                    "id": item_id(park, url),
+                    "park": park,
+                    "states": states,
+                    "title": title,
+                    "filename": filename,
+                    "path": str(Path(pdf_dir.name) / filename),
+                    "size_bytes": int(size),
+                    hash_algo: digest_hex,
+                    "source_url": url,
+                    "download_ok": True
+                }
+                results.put(item)
+
+            if (cache_entry(sha_cache, dest) or {}).get(hash_algo):
+                emit_existing()
+                return None
+            return hash_pool.submit(emit_existing)
+
+        if reuse:
+            return index_existing()
+
+        ok, size, digest_hex, validators = download_one(session, url, dest, timeout, verify_tls=verify_tls, durable=durable, hash_algo=hash_algo)
+        if not ok and exists:
+            # The staged write never replaced the old file, so keep indexing
+            # the copy on disk rather than reporting it as lost.
+            print(f"[WARN] Re-download failed for {url}; keeping existing copy", file=sys.stderr)
+            return index_existing()
+        if ok:
+            remember_digest(sha_cache, dest, digest_hex, validators, algo=hash_algo)
         item = {
-            "id": hashlib.sha1(f"{park}|{url}".encode("utf-8")).hexdigest()[:12],
+            "id": item_id(park, url),
             "park": park,
             "states": states,
             "title": title,
             "filename": filename,
             "path": str(Path(pdf_dir.name) / filename),
             "size_bytes": int(size),
-            "sha256": sha256_hex,
+            hash_algo: digest_hex,
             "source_url": url,
             "download_ok": bool(ok)
         }
-        with LOCK:
-            items.append(item)
+        results.put(item)
+        return None
 
-    if workers <= 1:
-        for r in rows:
-            process_row(r)
-    else:
-        with ThreadPoolExecutor(max_workers=workers) as ex:
-            for r in rows:
-                ex.submit(process_row, r)
+    # Bound in-flight rows so a large CSV can't queue every row, or every
+    # rehash, up front. A row keeps its slot until its rehash has finished.
+    slots = threading.BoundedSemaphore(max(workers, 1) * 4)
+
+    def release_after(hash_fut: Optional[Future], url: str):
+        if hash_fut is None:
+            slots.release()
+            return
+
+        def on_hashed(f):
+            slots.release()
+            report_failure(f, url)
+
+        hash_fut.add_done_callback(on_hashed)
+
+    try:
+        if workers <= 1:
+            for r in unique_rows(rows):
+                slots.acquire()
+                release_after(process_row(r), r["pdf_url"])
+        else:
+            def on_done(fut, r: Dict[str, str]):
+                # Report from the callback so finished futures aren't kept around.
+                if fut.exception() is not None:
+                    slots.release()
+                    report_failure(fut, r["pdf_url"])
+                    return
+                release_after(fut.result(), r["pdf_url"])
+
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for r in unique_rows(rows):
+                    slots.acquire()
+                    fut = ex.submit(process_row, r)
+                    fut.add_done_callback(lambda f, r=r: on_done(f, r))
+    finally:
+        hash_pool.shutdown(wait=True)
+
+    if cache_path:
+        save_sha_cache(cache_path, sha_cache)
+
+    items: List[Dict[str, Any]] = []
+    while True:
+        try:
+            items.append(results.get_nowait())
+        except queue.Empty:
+            break
 
     index = {
         "generated_at": datetime.now(timezone.utc).isoformat(),
@@ -377,10 +722,23 @@ function applyFilters(){
   render(FILTERED);
 }
 
+async function loadData(){
+  // Prefer the pre-gzipped index where the browser can inflate it; fall back to plain JSON.
+  if (typeof DecompressionStream !== "undefined") {
+    try{
+      const resp = await fetch(DATA_URL + ".gz");
+      if (resp.ok) {
+        return await new Response(resp.body.pipeThrough(new DecompressionStream("gzip"))).json();
+      }
+    }catch(e){ /* missing, or already decoded by the server: use plain JSON */ }
+  }
+  const resp = await fetch(DATA_URL);
+  return await resp.json();
+}
+
 async function boot(){
   try{
-    const resp = await fetch(DATA_URL);
-    DATA = (await resp.json()).items || [];
+    DATA = (await loadData()).items || [];
   }catch(e){
     console.error("Failed to load JSON", e);
     DATA = [];
@@ -397,12 +755,30 @@ boot();
 </html>
 """
 
+def dumps_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+def write_json(path: Path, obj: Any):
+    data = dumps_json(obj)
+    path.write_bytes(data)
+    # Pre-compressed siblings for the web app and for servers that serve
+    # precompressed files (gzip_static/brotli_static). mtime=0 keeps the
+    # .gz reproducible across runs with identical data.
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=6, mtime=0))
+    br_path = path.with_name(path.name + ".br")
+    if brotli is not None:
+        br_path.write_bytes(brotli.compress(data, quality=5))
+    else:
+        # Don't leave a .br from an earlier run to be served instead of the new index.
+        br_path.unlink(missing_ok=True)
+
 def write_index_html(out_dir: Path):
     out_dir.mkdir(parents=True, exist_ok=True)
     (out_dir / "index.html").write_text(INDEX_HTML, encoding="utf-8")
 
 def main():
-    import argparse
     ap = argparse.ArgumentParser(description="Download PDFs and build JSON for a static web viewer.")
     ap.add_argument("--csv", required=True, help="Input CSV with columns: park,state,pdf_url")
     ap.add_argument("--out", default="web", help="Output directory for site (default: web)")
@@ -411,7 +787,10 @@ def main():
     ap.add_argument("--workers", type=int, default=4, help="Parallel downloads (default: 4)")
     ap.add_argument("--timeout", type=int, default=60, help="Per-request timeout seconds (default: 60)")
     ap.add_argument("--force", action="store_true", help="Re-download even if the file exists")
+    ap.add_argument("--refresh", action="store_true", help="Re-download existing files only if the server reports a change (ETag/Last-Modified, or a different Content-Length when none is cached)")
     ap.add_argument("--write-index", action="store_true", help="Also write index.html into the output directory")
+    ap.add_argument("--durable", action="store_true", help="fsync each PDF before it is moved into place")
+    ap.add_argument("--hash-algo", choices=HASH_ALGOS, default="sha256", help="Digest recorded for each PDF (default: sha256; blake3 needs the blake3 package)")
     ap.add_argument("--insecure", action="store_true", help="Skip TLS verification (not recommended)")
     args = ap.parse_args()
 
@@ -424,16 +803,23 @@ def main():
         print(f"CSV not found: {csv_path}", file=sys.stderr)
         sys.exit(2)
 
+    if args.hash_algo == "blake3" and blake3 is None:
+        print("--hash-algo blake3 requires the blake3 package (pip install blake3)", file=sys.stderr)
+        sys.exit(2)
+
     rows = read_csv_rows(csv_path)
     index = build_index(
         rows, pdf_dir, args.force, args.workers, args.timeout,
-        verify_tls=(not args.insecure)
+        verify_tls=(not args.insecure),
+        cache_path=out_root / ".sha_cache.json",
+        durable=args.durable,
+        refresh=args.refresh,
+        hash_algo=args.hash_algo,
     )
     index["source_csv"] = str(csv_path)
 
     out_root.mkdir(parents=True, exist_ok=True)
-    with json_path.open("w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
+    write_json(json_path, index)
 
     if args.write_index:
         write_index_html(out_root)